@@ -1,14 +1,23 @@
 import argparse
+import concurrent.futures
+import ctypes
+import functools
+import io
 import itertools
 import freetype
+import numpy as np
 import os
 import pathlib
 
 
 debug_mode = False
+worker_face = None  # Face opened by a glyph rendering worker process
+ft_load_flags = freetype.FT_LOAD_RENDER | freetype.FT_LOAD_TARGET_MONO  # Mono bitmaps are 1 bit per pixel already
 ssd1306_page_size = 8
+ssd1306_page_bit_order = 'little'  # D0 of a GDDRAM byte is the topmost pixel of the page (see SSD1306 datasheet)
 c_glyph_line_max_items = 8
 c_lookup_func_arg_name = 'utf8_code'
+c_hex_bytes = tuple(f'0x{value:0>2X}u' for value in range(256))  # Glyph data literals, indexed by byte value
 c_disclaimer = """/**
  * 
  * ******************** DO NOT MODIFY THIS FILE MANUALLY! ********************
@@ -25,7 +34,7 @@ def parse_args():
                                                       'files to the C sources (.c + .h) which are easily compatible '
                                                       'with SSD1306 frame buffer.')
 
-    args_parser.add_argument('fontfile', type=argparse.FileType('rb'), help='file of a desired font')
+    args_parser.add_argument('fontfile', type=str, help='file of a desired font')
     args_parser.add_argument(
         '--cname', '-cn',
         type=str,
@@ -63,65 +72,59 @@ def parse_args():
         action='store_true',
         default=False
     )
-    return args_parser.parse_args()
-
-
-def print_image(img_2d, off='.', on='#'):
-    for row in img_2d:
-        for pixel in row:
-            print(on if pixel > 0 else off, end='')
-        print(end='\n')
+    args_parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help='number of processes rendering glyphs in parallel (default - 1)'
+    )
+    args = args_parser.parse_args()
+    if not os.path.isfile(args.fontfile):
+        args_parser.error(f'can\'t open font file \'{args.fontfile}\'')
+    return args
 
 
-def glyph_insert_empty_cols(glyph_2d, columns_left=0, columns_right=0):
-    return [[0] * columns_left + glyph_row + [0] * columns_right for glyph_row in glyph_2d]
+def image_to_str(img_2d, off='.', on='#'):
+    return '\n'.join(''.join(on if pixel > 0 else off for pixel in row) for row in img_2d)
 
 
-def append_height(glyph_2d, target_height):
-    if len(glyph_2d) < 1:
-        raise Exception("Glyph is empty!")
+def print_image(img_2d, off='.', on='#'):
+    print(image_to_str(img_2d, off, on))
 
-    count_to_append = target_height - len(glyph_2d)
-    width = len(glyph_2d[0])
-    appendix = [[0] * width for _ in range(count_to_append)]
-    return appendix + glyph_2d
 
+def height_padding(glyph_2d, target_height):
+    return max(target_height - len(glyph_2d), 0)
 
-def append_width(glyph_2d, target_width):
-    if len(glyph_2d) < 1:
-        raise Exception("Glyph is empty!")
 
-    glp_width = len(glyph_2d[0])
-    if glp_width < 1:
+def width_padding(glyph_2d, target_width):
+    glp_width = glyph_2d.shape[1]
+    if len(glyph_2d) > 0 and glp_width < 1:
         raise Exception("Glyph has no width!")
 
     width_diff = target_width - glp_width
     if width_diff < 0:
         raise Exception("Glyph has bigger width than it should be appended!")
 
-    if width_diff == 0:
-        return glyph_2d
-
     diff_start = width_diff // 2
     diff_end = width_diff - diff_start  # For cases, when width_diff cannot be divided by 2 w/o reminder
-    return glyph_insert_empty_cols(glyph_2d, diff_start, diff_end)
-
-
-def append_glyph(glyph_2d, target_width, target_height):
-    return append_height(append_width(glyph_2d, target_width), target_height)
+    return diff_start, diff_end
 
 
+@functools.lru_cache(maxsize=None)
 def face_load_char(face, char, width=0, height=ssd1306_page_size):
-    char_flags = freetype.FT_LOAD_FLAGS['FT_LOAD_RENDER'] | freetype.FT_LOAD_TARGETS['FT_LOAD_TARGET_MONO']
+    # Size is set on every load, so hinting state left by other chars doesn't change the glyph
     face.set_pixel_sizes(width, height)
-    face.load_char(char, flags=char_flags)
+    face.load_char(char, flags=ft_load_flags)
+    glyph_bitmap = face.glyph.bitmap
+    # Bitmap.buffer builds a list of ints, so the raw FreeType buffer is copied instead
+    glyph_buffer = ctypes.string_at(glyph_bitmap._FT_Bitmap.buffer, glyph_bitmap.rows * glyph_bitmap.pitch)
+    return glyph_bitmap.width, glyph_bitmap.rows, glyph_bitmap.pitch, glyph_buffer
 
 
 def find_max_glyph_width(face, chars, height):
     max_width = None
     for char in chars:
-        face_load_char(face, char, height=height)
-        glyph_width = face.glyph.bitmap.width
+        glyph_width, _, _, _ = face_load_char(face, char, 0, height)
         if max_width is None or max_width < glyph_width:
             max_width = glyph_width
     return max_width
@@ -136,62 +139,47 @@ def generate_glyph(
         right_fields=0,
         pad_width=None
 ):
-    if debug_mode:
+    debug = debug_mode  # Checked on every step, so it's looked up once
+
+    if debug:
         print('--------------------------------------')
         print(f'Generating char glyph for {character}, desired size: {width} x {height}...')
 
-    face_load_char(face, character, width, height)
-    glyph_bitmap = face.glyph.bitmap
-    glyph_width = glyph_bitmap.width
-    glyph_height = glyph_bitmap.rows
+    glyph_width, glyph_height, glyph_pitch, glyph_buffer = face_load_char(face, character, width, height)
 
-    if debug_mode:
+    if debug:
         print(f'Real glyph size is {glyph_width} x {glyph_height}')
 
-    glyph_img = glyph_bitmap.buffer
-
-    bytes_per_row = len(glyph_img) // glyph_height
-    glyph_2d = []
-
-    for y in range(0, glyph_height):
-        row = []
-        start_byte = y * bytes_per_row
-        end_byte = y * bytes_per_row + bytes_per_row
-        row_bytes = glyph_img[start_byte:end_byte]
-        for row_bit_index in range(0, len(row_bytes) * 8):
-            byte_index = row_bit_index // 8
-            bit_index = 7 - (row_bit_index % 8)
-            value = 0x1 if ((row_bytes[byte_index] & (0x1 << bit_index)) >> bit_index) > 0 else 0x0
-            row.append(value)
-        glyph_2d.append(row[0:glyph_width])
-
-    glyph_2d = glyph_2d[0:glyph_height]
+    if glyph_height > 0:
+        glyph_rows = np.frombuffer(glyph_buffer, dtype=np.uint8).reshape(glyph_height, glyph_pitch)
+        # Mono bitmap rows are MSB-first, so unpacking them gives pixels in left-to-right order
+        glyph_2d = np.unpackbits(glyph_rows, axis=1)[:, :glyph_width]
+    else:
+        glyph_2d = np.zeros((0, 0), dtype=np.uint8)  # Blank glyph (e.g. a space), padded up from nothing
 
-    if debug_mode:
+    if debug:
         print('Generated glyph: ')
         print_image(glyph_2d)
-
-    if debug_mode:
-        if width is not None:
+        if pad_width is not None or width > 0:
             print('Will append both horizontally and vertically')
         else:
             print('Will append only vertically')
 
-    glyph_appended = None
+    cols_left, cols_right = 0, 0
     if pad_width is not None:
-        glyph_appended = append_glyph(glyph_2d, pad_width, height)
+        cols_left, cols_right = width_padding(glyph_2d, pad_width)
     elif width > 0:
-        glyph_appended = append_glyph(glyph_2d, width, height)
-    else:
-        glyph_appended = append_height(glyph_2d, height)
+        cols_left, cols_right = width_padding(glyph_2d, width)
+    rows_top = height_padding(glyph_2d, height)
 
-    if debug_mode:
+    if debug:
         if left_fields > 0 or right_fields > 0:
             print(f'Will add fields to the glyph: L: {left_fields} R: {right_fields}')
 
-    result = glyph_insert_empty_cols(glyph_appended, columns_left=left_fields, columns_right=right_fields)
+    # Centering, vertical alignment and fields are all applied with a single allocation
+    result = np.pad(glyph_2d, ((rows_top, 0), (cols_left + left_fields, cols_right + right_fields)))
 
-    if debug_mode:
+    if debug:
         print('Ready glyph: ')
         print_image(result)
 
@@ -211,56 +199,62 @@ def glyph_size(glyph_2d):
 
 
 def convert_to_ssd1306_format(glyph_2d, g_width, g_height, hor_mode=False):
-    glyph_rotated = [[glyph_2d[y][x] for y in range(g_height)] for x in range(g_width)]
+    page_per_col = g_height // ssd1306_page_size
+    glyph = np.asarray(glyph_2d, dtype=np.uint8)[0:page_per_col * ssd1306_page_size, 0:g_width]
 
     if debug_mode:
         print('Transformed glyph for the SSD1306: ')
-        print_image(glyph_rotated)
+        print_image(glyph.T)
+        print(f'Glyph is {g_width} x {g_height} --> each glyph column will take {page_per_col} pages')
+        glyph_paged = glyph.reshape(page_per_col, ssd1306_page_size, g_width)
+        print('Paged glyph:')
+        print('\n'.join(
+            ''.join(f'Page {page}: |{image_to_str([glyph_paged[page, :, col]])}| ' for page in range(page_per_col))
+            for col in range(g_width)
+        ))
+
+    return pack_pages(glyph[np.newaxis], hor_mode)[0]
+
 
+def pack_pages(glyphs_3d, hor_mode=False):
+    count, g_height, g_width = glyphs_3d.shape
     page_per_col = g_height // ssd1306_page_size
+    glyphs_paged = glyphs_3d.reshape(count, page_per_col, ssd1306_page_size, g_width)
 
-    if debug_mode:
-        print(f'Glyph is {g_width} x {g_height} --> each glyph column will take {page_per_col} pages')
+    pages = np.packbits(glyphs_paged, axis=2, bitorder=ssd1306_page_bit_order).reshape(count, page_per_col, g_width)
 
-    def take_page(col, page):
-        page_start = page * ssd1306_page_size
-        page_end = page_start + ssd1306_page_size
-        return glyph_rotated[col][page_start:page_end]
+    return (pages if hor_mode else pages.transpose(0, 2, 1)).reshape(count, -1)
 
-    glyph_paged = [[take_page(col, page) for page in range(page_per_col)] for col in range(g_width)]
 
-    if debug_mode:
-        print('Paged glyph:')
-        for col in range(g_width):
-            for page in range(page_per_col):
-                print(f'Page {page}: |', end='')
-                for row in range(ssd1306_page_size):
-                    print('#' if glyph_paged[col][page][row] > 0 else '.', end='')
-                print('| ', end='')
-            print(end='\n')
-
-    def get_pixel(page, y):
-        return page[y] << y
-
-    def build_page(page, col):
-        page_bin = [get_pixel(glyph_paged[col][page], row) for row in range(len(glyph_paged[col][page]))]
-        page_value = 0x0
-        for page_pixel in page_bin:
-            page_value |= page_pixel
-        return page_value
-
-    result = list()
-
-    if hor_mode:
-        for page in range(page_per_col):
-            for col in range(g_width):
-                result.append(build_page(page, col))
-    else:
-        for col in range(g_width):
-            for page in range(page_per_col):
-                result.append(build_page(page, col))
+def build_glyph(face, char, glyph_w=None, glyph_h=0, left_fields=0, right_fields=0, pad_width=None):
+    glyph = generate_glyph(
+        face,
+        char,
+        width=glyph_w or 0, height=glyph_h,
+        left_fields=left_fields, right_fields=right_fields,
+        pad_width=pad_width
+    )
 
-    return result
+    real_w, real_h = glyph_size(glyph)
+
+    if glyph_w is not None and real_w > glyph_w:
+        print(f'WARNING! {char} ({utf_8_encode(char)}) exceeded width ({real_w}), cutting to {glyph_w}')
+        real_w = glyph_w
+
+    if 0 < glyph_h < real_h:
+        print(f'WARNING! {char} ({utf_8_encode(char)}) exceeded height ({real_h}), cutting to {glyph_h}')
+        real_h = glyph_h
+
+    return glyph[0:real_h, 0:real_w]
+
+
+def worker_init(font_path):
+    global worker_face
+    worker_face = freetype.Face(font_path)
+
+
+def worker_build_glyph(char, *build_args):
+    return build_glyph(worker_face, char, *build_args)
 
 
 def prepare_for_ssd1306(
@@ -268,64 +262,80 @@ def prepare_for_ssd1306(
         glyph_w=None, glyph_h=0,
         left_fields=0, right_fields=0,
         hor_pages=False,
-        pad_width=None
+        pad_width=None,
+        jobs=1, font_path=None
 ):
-    def build_glyph(char):
-        glyph = generate_glyph(
-            face,
-            char,
-            width=glyph_w, height=glyph_h,
-            left_fields=left_fields, right_fields=right_fields,
-            pad_width=pad_width
-        ) if glyph_w is not None else generate_glyph(
-            face,
-            char,
-            height=glyph_h,
-            left_fields=left_fields, right_fields=right_fields,
-            pad_width=pad_width
-        )
+    build_args = (glyph_w, glyph_h, left_fields, right_fields, pad_width)
 
-        real_w, real_h = glyph_size(glyph)
+    def pack_glyph(glyph):
+        real_h, real_w = glyph.shape
+        return bytes((real_w, real_h)) + convert_to_ssd1306_format(glyph, real_w, real_h, hor_mode=hor_pages).tobytes()
 
-        if glyph_w is not None and real_w > glyph_w:
-            print(f'WARNING! {char} ({utf_8_encode(char)}) exceeded width ({real_w}), cutting to {glyph_w}')
-            real_w = glyph_w
+    if debug_mode:
+        # Keep the dumps of every glyph together
+        return [(char, pack_glyph(build_glyph(face, char, *build_args))) for char in chars]
+
+    if jobs > 1 and font_path is not None:
+        # FreeType faces aren't shareable, so each worker process opens its own one
+        with concurrent.futures.ProcessPoolExecutor(
+                jobs,
+                initializer=worker_init,
+                initargs=(font_path,)
+        ) as executor:
+            build_args_repeated = [itertools.repeat(arg) for arg in build_args]
+            glyphs = list(executor.map(worker_build_glyph, chars, *build_args_repeated, chunksize=32))
+    else:
+        glyphs = [build_glyph(face, char, *build_args) for char in chars]
 
-        if 0 < glyph_h < real_h:
-            print(f'WARNING! {char} ({utf_8_encode(char)}) exceeded height ({real_h}), cutting to {glyph_h}')
-            real_h = glyph_h
+    if len({glyph.shape for glyph in glyphs}) != 1:
+        return [(char, pack_glyph(glyph)) for char, glyph in zip(chars, glyphs)]
 
-        ssd_glyph = convert_to_ssd1306_format(glyph, real_w, real_h, hor_mode=hor_pages)
+    # Glyphs of the same size are packed all at once
+    real_h, real_w = glyphs[0].shape
+    glyphs_packed = pack_pages(np.stack(glyphs), hor_mode=hor_pages)
+    glyph_size_bytes = bytes((real_w, real_h))
+    return [(char, glyph_size_bytes + glyph_packed.tobytes()) for char, glyph_packed in zip(chars, glyphs_packed)]
 
-        return [real_w, real_h] + ssd_glyph
-    return [(char, build_glyph(char)) for char in chars]
+
+def merge_char_ranges(char_ranges):
+    result = []
+    for (start, end) in sorted(char_ranges):
+        if len(result) > 0 and start <= result[-1][1] + 1:  # Overlaps or touches the previous one
+            result[-1] = (result[-1][0], max(result[-1][1], end))
+        else:
+            result.append((start, end))
+    return result
 
 
 def parse_chars_to_convert(char_list):
-    result = []
+    char_ranges = []
     for char_item in char_list:
-        if len(char_item) > 1:  # We got a char range as an item
-            (start, end) = char_item.split(sep='-')
-            char_range = [chr(char) for char in range(ord(start), ord(end))] + [end]
-            result += char_range
+        if len(char_item) == 3 and char_item[1] == '-':  # We got a char range as an item
+            # Taken by position, so '-' itself can be a range bound, e.g. '!--'
+            range_start, range_end = ord(char_item[0]), ord(char_item[2])
+            if range_start > range_end:
+                raise Exception(f'Wrong chars set "{char_item}"! Range start should not go after its end')
+            char_ranges.append((range_start, range_end))
+        elif len(char_item) == 1:
+            char_ranges.append((ord(char_item), ord(char_item)))
         else:
-            result.append(char_item)
-    result_unique = list(set(result))
-    result_unique.sort()
-    return result_unique
+            raise Exception(f'Wrong chars set "{char_item}"! It should be a single char or a range like "a-z"')
+    # Merged ranges are sorted and disjoint, so chars come out unique and in order
+    return [chr(code) for (start, end) in merge_char_ranges(char_ranges) for code in range(start, end + 1)]
 
 
+@functools.lru_cache(maxsize=None)
 def utf_8_encode(char):
+    code_point = ord(char)
+    if code_point < 0x80:  # ASCII chars are encoded as is
+        return code_point
+
     utf_8_code = char.encode('utf-8')
     return int.from_bytes(utf_8_code, byteorder='big')
 
 
 def group_chars(chars):
-    def calculate_offset(index):
-        offset = utf_8_encode(chars[index]) - index
-        return chars[index], offset
-
-    chars_offset = [calculate_offset(index) for index in range(len(chars))]
+    chars_offset = [(char, utf_8_encode(char) - index) for index, char in enumerate(chars)]
 
     chars_grouped = itertools.groupby(chars_offset, lambda x: x[1])
     result = [(group_n, [char[0] for char in chars_group]) for (group_n, chars_group) in chars_grouped]
@@ -341,29 +351,45 @@ def group_chars(chars):
 def groups_reduce(groups):
     def reduce_group(group):
         (offset, items) = group
-        item_min = min(items)
-        item_max = max(items)
-        return offset, item_min, item_max
+        # Chars are sorted, so are the groups. Bounds are kept encoded, as they are used only in the C code
+        return offset, utf_8_encode(items[0]), utf_8_encode(items[-1])
     return [reduce_group(group) for group in groups]
 
 
 def c_gen_group_if(group, arg_name):
     (offset, item_min, item_max) = group
-    item_min = utf_8_encode(item_min)
-    item_max = utf_8_encode(item_max)
 
     if item_min == item_max:
         return f'if ({item_min} == {arg_name}) ' \
                + '{ ' + f'return {arg_name} - {offset};' \
                + ' };'
     else:
-        return f'if ({item_min} <= {arg_name} && {arg_name} <= {item_max}) ' \
+        # Unsigned subtraction wraps below item_min, so one comparison checks both bounds
+        return f'if ({arg_name} - {item_min}u <= {item_max - item_min}u) ' \
                + '{ ' + f'return {arg_name} - {offset};' \
                + ' };'
 
 
-def c_format_to_hex(value):
-    return f'0x{value:0>2X}u'
+# Binary search over the groups, they have to be sorted by their first code
+def c_gen_group_tree(groups, arg_name, indent=1):
+    tabs = '\t' * indent
+    middle = len(groups) // 2
+    (offset, item_min, item_max) = groups[middle]
+    groups_left = groups[:middle]
+    groups_right = groups[middle + 1:]
+
+    if len(groups_left) < 1:  # Then there is nothing to the right as well
+        return f'{tabs}{c_gen_group_if(groups[middle], arg_name)}\n'
+
+    code = f'{tabs}if ({arg_name} < {item_min}) ' + '{\n'
+    code += c_gen_group_tree(groups_left, arg_name, indent + 1)
+    code += f'{tabs}' + '} ' + f'else if ({arg_name} <= {item_max}) ' + '{\n'
+    code += f'{tabs}\treturn {arg_name} - {offset};\n'
+    if len(groups_right) > 0:
+        code += f'{tabs}' + '} else {\n'
+        code += c_gen_group_tree(groups_right, arg_name, indent + 1)
+    code += f'{tabs}' + '}\n'
+    return code
 
 
 def c_write_disclaimer(fout):
@@ -396,34 +422,69 @@ def c_header_write_bottom_part(fout, cname):
     fout.write(f'#endif // End of {guard}\n')
 
 
-def c_src_write_include(fout, header_file):
-    fout.write(f'#include "{os.path.basename(header_file.name)}"\n\n')
+def c_src_write_include(fout, header_file_name):
+    fout.write(f'#include "{header_file_name}"\n\n')
+
+
+def c_gen_glyph_data_name(cname):
+    return f'ssd1306_{cname.lower()}_glyph_data'
 
 
-def c_gen_glyph_array_name(cname, char):
-    return f'ssd1306_{cname.lower()}_glyph_data_{utf_8_encode(char)}'
+def c_gen_glyph_offsets_name(cname):
+    return f'ssd1306_{cname.lower()}_glyph_offsets'
 
 
-def c_gen_glyph_data(cname, glyph):
-    (char, data) = glyph
+def c_gen_items_lines(items, indent=1):
     max_items = c_glyph_line_max_items
-    chunk_count = len(data) // max_items + (1 if len(data) % max_items > 0 else 0)
-    chunks = [data[(chunk_ind * max_items):(chunk_ind * max_items) + max_items] for chunk_ind in range(0, chunk_count)]
-    chunks_formatted = [', '.join([c_format_to_hex(c) for c in chunk]) for chunk in chunks]
-    data_str = ', \n'.join(['\t' + item for item in chunks_formatted])
-    return f'static const uint8_t {c_gen_glyph_array_name(cname, char)}[] = ' + '{\n' + data_str + '\n};'
+    tabs = '\t' * indent
+    return ', \n'.join([tabs + ', '.join(items[start:start + max_items]) for start in range(0, len(items), max_items)])
+
+
+def c_gen_glyph_data(chars, data, as_row=False):
+    c_comment = '\t/* ' + ', '.join([str(utf_8_encode(char)) for char in chars]) + ' */\n'
+    c_data = list(map(c_hex_bytes.__getitem__, data))
+    if as_row:
+        return c_comment + '\t{\n' + c_gen_items_lines(c_data, indent=2) + '\n\t}'
+    return c_comment + c_gen_items_lines(c_data)
+
+
+def c_glyphs_equal_size(glyphs):
+    return len({len(data) for (_, data) in glyphs}) == 1
 
 
 def c_src_write_glyphs_array(fout, cname, glyphs):
-    c_glyphs_data = '\n\n'.join([c_gen_glyph_data(cname, glyph) for glyph in glyphs])
-    glyphs_table = [c_gen_glyph_array_name(cname, glyph[0]) for glyph in glyphs]
-    c_glyphs_table = f'static const uint8_t* const ssd1306_{cname.lower()}_glyph_table[] = ' + '{\n' + \
-                     ', \n'.join(['\t' + glyph_ptr_name for glyph_ptr_name in glyphs_table]) + \
-                     '\n};'
+    if c_glyphs_equal_size(glyphs):
+        # Glyphs of the same size are rows of a 2D array, so no offsets are needed
+        glyph_size = len(glyphs[0][1])
+        c_glyphs_data = f'static const uint8_t {c_gen_glyph_data_name(cname)}[{len(glyphs)}][{glyph_size}] = ' + \
+                        '{\n' + \
+                        ', \n'.join([c_gen_glyph_data([char], data, as_row=True) for (char, data) in glyphs]) + \
+                        '\n};'
+        fout.write(c_glyphs_data)
+        fout.write('\n\n')
+        return
+
+    # Otherwise all glyphs are stored back to back in one array, each is found by its offset there.
+    # Identical glyphs are stored only once and share the offset
+    unique_glyphs = {}  # Glyph data -> chars having it, in order of appearance
+    for (char, data) in glyphs:
+        unique_glyphs.setdefault(data, []).append(char)
+
+    c_glyphs_data = f'static const uint8_t {c_gen_glyph_data_name(cname)}[] = ' + '{\n' + \
+                    ', \n'.join([c_gen_glyph_data(chars, data) for (data, chars) in unique_glyphs.items()]) + \
+                    '\n};'
+
+    unique_offsets = itertools.accumulate([len(data) for data in unique_glyphs], initial=0)
+    data_offsets = dict(zip(unique_glyphs, unique_offsets))
+    offsets = [data_offsets[data] for (_, data) in glyphs]
+    offset_type = 'uint16_t' if max(offsets) <= 0xFFFF else 'uint32_t'
+    c_offsets_table = f'static const {offset_type} {c_gen_glyph_offsets_name(cname)}[] = ' + '{\n' + \
+                      c_gen_items_lines([f'0x{offset:0>4X}u' for offset in offsets]) + \
+                      '\n};'
 
     fout.write(c_glyphs_data)
     fout.write('\n\n')
-    fout.write(c_glyphs_table)
+    fout.write(c_offsets_table)
     fout.write('\n\n')
 
 
@@ -432,20 +493,20 @@ def c_src_write_lookup_func(fout, cname, reduced_groups):
     fout.write(f'(uint32_t {c_lookup_func_arg_name})')
     fout.write(' {\n')
 
-    for group in reduced_groups:
-        c_group_code = c_gen_group_if(group, c_lookup_func_arg_name)
-        fout.write('\t')
-        fout.write(c_group_code)
-        fout.write('\n')
-
+    if len(reduced_groups) > 0:
+        groups_sorted = sorted(reduced_groups, key=lambda group: group[1])
+        fout.write(c_gen_group_tree(groups_sorted, c_lookup_func_arg_name))
     fout.write('\treturn 0;\n}\n\n')
 
 
-def c_src_write_glyph_func(fout, cname):
+def c_src_write_glyph_func(fout, cname, glyphs):
     fout.write(f'const uint8_t* ssd1306_{cname.lower()}_get_glyph')
     fout.write(f'(uint32_t {c_lookup_func_arg_name})' + ' {\n')
     fout.write(f'\tuint32_t glyph_index = ssd1306_{cname.lower()}_get_glyph_index({c_lookup_func_arg_name});\n')
-    fout.write(f'\treturn ssd1306_{cname.lower()}_glyph_table[glyph_index];\n')
+    if c_glyphs_equal_size(glyphs):
+        fout.write(f'\treturn {c_gen_glyph_data_name(cname)}[glyph_index];\n')
+    else:
+        fout.write(f'\treturn &{c_gen_glyph_data_name(cname)}[{c_gen_glyph_offsets_name(cname)}[glyph_index]];\n')
     fout.write('}\n')
 
 
@@ -453,7 +514,7 @@ def app():
     args = parse_args()
     global debug_mode
     debug_mode = args.debug
-    face = freetype.Face(args.fontfile)
+    face = freetype.Face(args.fontfile)  # FreeType reads the file by itself
 
     cname = args.cname
 
@@ -467,9 +528,6 @@ def app():
     out_h_file_path = os.path.join(out_abs_path, out_h_file_name)
     out_c_file_path = os.path.join(out_abs_path, out_c_file_name)
 
-    out_h_file = open(out_h_file_path, 'w')
-    out_c_file = open(out_c_file_path, 'w')
-
     glyph_w = args.glyph_width
     glyph_h = args.glyph_height
 
@@ -493,28 +551,35 @@ def app():
         glyph_w, glyph_h,
         args.fields_left, args.fields_right,
         hor_pages=args.horizontal_paging,
-        pad_width=find_max_glyph_width(face, chars_to_gen, glyph_h) if args.glyph_width_equal else None
+        pad_width=find_max_glyph_width(face, chars_to_gen, glyph_h) if args.glyph_width_equal else None,
+        jobs=args.jobs, font_path=args.fontfile
     )
     reduced_char_groups = groups_reduce(group_chars(chars_to_gen))
 
     print(f'Done! Glyphs data took {len(ssd1306_glyph_data) * len(ssd1306_glyph_data[0])} bytes.\nWriting .h-file...')
 
+    # Both files are built in memory and written at once
+    out_h_buffer = io.StringIO()
+    out_c_buffer = io.StringIO()
+
     # Header file
-    c_header_write_top_part(out_h_file, cname)
-    c_write_disclaimer(out_h_file)
-    c_header_write_glyph_count(out_h_file, cname, len(ssd1306_glyph_data))
-    c_header_write_glyph_func_proto(out_h_file, cname)
-    c_header_write_bottom_part(out_h_file, cname)
+    c_header_write_top_part(out_h_buffer, cname)
+    c_write_disclaimer(out_h_buffer)
+    c_header_write_glyph_count(out_h_buffer, cname, len(ssd1306_glyph_data))
+    c_header_write_glyph_func_proto(out_h_buffer, cname)
+    c_header_write_bottom_part(out_h_buffer, cname)
 
     # Source file
-    c_src_write_include(out_c_file, out_h_file)
-    c_write_disclaimer(out_c_file)
-    c_src_write_glyphs_array(out_c_file, cname, ssd1306_glyph_data)
-    c_src_write_lookup_func(out_c_file, cname, reduced_char_groups)
-    c_src_write_glyph_func(out_c_file, cname)
-
-    out_h_file.close()
-    out_c_file.close()
+    c_src_write_include(out_c_buffer, out_h_file_name)
+    c_write_disclaimer(out_c_buffer)
+    c_src_write_glyphs_array(out_c_buffer, cname, ssd1306_glyph_data)
+    c_src_write_lookup_func(out_c_buffer, cname, reduced_char_groups)
+    c_src_write_glyph_func(out_c_buffer, cname, ssd1306_glyph_data)
+
+    with open(out_h_file_path, 'w') as fout:
+        fout.write(out_h_buffer.getvalue())
+    with open(out_c_file_path, 'w') as fout:
+        fout.write(out_c_buffer.getvalue())
 
 
 if __name__ == '__main__':